@@ -1,8 +1,13 @@
 # ai_diagnosis.py
-import os, openai, json
+import os, openai, json, time
+from collections import Counter
+from equipment_schema import SYSTEMS, schema_for, system_for_component
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
+# "openai" (gpt-4o, needs network) or "local" (offline model fitted on stored history)
+DIAGNOSIS_BACKEND = os.getenv("DIAGNOSIS_BACKEND", "openai")
+
 PROMPT_TEMPLATE = """
 You are a building automation diagnostic assistant.
 Given this data:
@@ -15,14 +20,7 @@ Return JSON with keys: summary, abnormalities, recommendations.
 Do not wrap the response in a code block.
 """
 
-def analyze(data_json):
-    prompt = PROMPT_TEMPLATE.format(data=json.dumps(data_json))
-    resp = openai.ChatCompletion.create(
-        model="gpt-4o",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.2
-    )
-    content = resp.choices[0].message.content
+def parse_response(content):
     # Strip code block if present
     if content.startswith("```json\n") and content.endswith("\n```"):
         content = content[8:-4]
@@ -31,3 +29,137 @@ def analyze(data_json):
     except Exception as e:
         print(f"⚠️ Error parsing LLM response: {e}")
         return {"summary": "Error parsing AI response", "abnormalities": [], "recommendations": []}
+
+class OpenAIBackend:
+    name = "openai"
+
+    def fit(self, history):
+        pass
+
+    def generate(self, data_json):
+        prompt = PROMPT_TEMPLATE.format(data=json.dumps(data_json))
+        resp = openai.ChatCompletion.create(
+            model="gpt-4o",
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.2
+        )
+        return resp.choices[0].message.content
+
+class LocalBackend:
+    """Offline template generator: rule-based abnormalities plus the recommendations
+    most often given for each system in stored diagnoses."""
+    name = "local"
+
+    def __init__(self):
+        # system key -> [{"action", "priority"}], learned by fit()
+        self.recommendations = {}
+
+    def fit(self, history):
+        counts = {s["key"]: Counter() for s in SYSTEMS}
+        for entry in history:
+            try:
+                raw_data = json.loads(entry.get("raw_data", "{}"))
+                status = json.loads(entry["status"]) if entry.get("status") else {}
+            except (json.JSONDecodeError, ValueError, TypeError, AttributeError):
+                continue
+            if not isinstance(status, dict) or not isinstance(raw_data, dict) or "equipment" not in raw_data:
+                continue
+            recommendations = status.get("recommendations")
+            if not isinstance(recommendations, list):
+                continue
+            if status.get("backend") == self.name:
+                # Don't retrain on our own output
+                continue
+            flagged = self._flagged(schema_for(raw_data).check(raw_data))
+            if not flagged:
+                continue
+            for rec in recommendations:
+                if not isinstance(rec, dict) or not isinstance(rec.get("action"), str):
+                    continue
+                # Credit the system the action names; unnamed actions only when a single system was flagged
+                key = self._system_for_action(rec["action"])
+                if key is None and len(flagged) == 1:
+                    key = next(iter(flagged))
+                if key not in flagged:
+                    continue
+                priority = rec.get("priority") if isinstance(rec.get("priority"), str) else "Medium"
+                counts[key][(rec["action"], priority)] += 1
+        self.recommendations = {
+            key: [{"action": a, "priority": p} for (a, p), _ in counter.most_common(3)]
+            for key, counter in counts.items() if counter
+        }
+
+    def generate(self, data_json):
+        schema = schema_for(data_json)
+        abnormalities = schema.check(data_json)
+        recommendations = []
+        flagged = self._flagged(abnormalities)
+        for system in SYSTEMS:
+            if system["key"] in flagged:
+                recommendations.extend(self.recommendations.get(system["key"]) or system["recommendations"])
+        return json.dumps({
+            "summary": schema.summarize(data_json),
+            "abnormalities": abnormalities,
+            "recommendations": recommendations,
+            "backend": self.name
+        })
+
+    @staticmethod
+    def _system_for_action(action):
+        lowered = action.lower()
+        for system in SYSTEMS:
+            if system["key"] in lowered or system["unit_prefix"].lower() in lowered:
+                return system["key"]
+        return None
+
+    @staticmethod
+    def _flagged(abnormalities):
+        return {system_for_component(ab["component"]) for ab in abnormalities} - {None}
+
+BACKENDS = {b.name: b for b in (OpenAIBackend, LocalBackend)}
+_backends = {}
+_history = []
+
+def fit_backends(history):
+    """Store the diagnosis history and (re)fit every backend created so far; later ones fit on creation."""
+    global _history
+    _history = history
+    for backend in _backends.values():
+        backend.fit(history)
+
+def get_backend(name=None):
+    name = name or DIAGNOSIS_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown diagnosis backend: {name}")
+    if name not in _backends:
+        backend = BACKENDS[name]()
+        backend.fit(_history)
+        _backends[name] = backend
+    return _backends[name]
+
+def analyze(data_json, backend=None):
+    return parse_response(get_backend(backend).generate(data_json))
+
+def compare(data_json, backends=("openai", "local")):
+    """Run the same snapshot through several backends; report latency and abnormality agreement."""
+    results = {}
+    for name in backends:
+        start = time.perf_counter()
+        try:
+            result = analyze(data_json, name)
+        except Exception as e:
+            result = {"summary": f"Backend error: {e}", "abnormalities": [], "recommendations": []}
+        abnormalities = result.get("abnormalities") if isinstance(result, dict) else None
+        components = {
+            ab["component"] for ab in (abnormalities if isinstance(abnormalities, list) else [])
+            if isinstance(ab, dict) and "component" in ab
+        }
+        results[name] = {
+            "result": result,
+            "latency_ms": round((time.perf_counter() - start) * 1000, 3),
+            "components": components
+        }
+    sets = [r.pop("components") for r in results.values()]
+    union = set().union(*sets)
+    agreement = len(set.intersection(*sets)) / len(union) if union else 1.0
+    return {"backends": results, "agreement": round(agreement, 3)}
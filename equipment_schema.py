@@ -0,0 +1,197 @@
+# equipment_schema.py
+# Per-building equipment registry. A snapshot's topology is discovered in one
+# pass and compiled into flat per-system unit-ID arrays, so summaries,
+# abnormality rules and charts walk every unit in a single pass instead of
+# hard-coding the Compressor0{i}/Boiler0{i}/AHU0{i} demo layout.
+
+# System definitions: raw key, unit prefix, chart point and the rules applied
+# to each unit. A rule lists the unit points it reads; `test` receives those
+# values in the same order. `key_points` are system-level readings and
+# `unit_key_points` are averaged across units; both feed the fleet rollups.
+SYSTEMS = [
+    {
+        "key": "chiller",
+        "raw_key": "ChillerSystem",
+        "unit_prefix": "Compressor",
+        "chart_point": "dischargePressure",
+        "chart_label": "Discharge Pressure (psig)",
+        "key_points": ("chilledWaterSupplyTemp", "coolingTowerFanSpeed"),
+        "unit_key_points": ("dischargePressure",),
+        "rules": [
+            {
+                "points": ("dischargePressure",),
+                "test": lambda p: p > 350,
+                "issue": "High discharge pressure",
+                "value": "{0} psig",
+                "normalRange": "300-350",
+            },
+        ],
+        "recommendations": [
+            {"action": "Check chiller condenser for fouling or scaling", "priority": "High"},
+            {"action": "Inspect cooling tower fan operation", "priority": "Medium"},
+        ],
+    },
+    {
+        "key": "boiler",
+        "raw_key": "BoilerSystem",
+        "unit_prefix": "Boiler",
+        "chart_point": "supplyTemp",
+        "chart_label": "Supply Temp (°F)",
+        "key_points": ("hotWaterSupplyTemp",),
+        "unit_key_points": ("supplyTemp",),
+        "rules": [
+            {
+                "points": ("burnerStatus", "supplyTemp"),
+                "test": lambda burner, temp: burner == "Off" and temp > 150,
+                "issue": "Burner off but high supply temp",
+                "value": "{1}°F",
+            },
+        ],
+        "recommendations": [
+            {"action": "Investigate boiler sensor or control issues", "priority": "Medium"},
+        ],
+    },
+    {
+        "key": "ahu",
+        "raw_key": "AirHandlers",
+        "unit_prefix": "AHU",
+        "chart_point": "supplyAirTemp",
+        "chart_label": "Supply Air Temp (°F)",
+        "key_points": (),
+        "unit_key_points": ("supplyAirTemp",),
+        "rules": [
+            {
+                "points": ("supplyAirTemp",),
+                "test": lambda t: t < 58,
+                "issue": "Low supply air temperature",
+                "value": "{0}°F",
+                "normalRange": "58-62",
+            },
+        ],
+        "recommendations": [
+            {"action": "Check AHU cooling coils and temperature sensors", "priority": "Medium"},
+        ],
+    },
+]
+
+SYSTEMS_BY_KEY = {s["key"]: s for s in SYSTEMS}
+
+# Defaults used when a unit is missing a point, matching the old `.get(point, 0)`
+POINT_DEFAULTS = {"status": None, "burnerStatus": None}
+
+
+def system_for_component(component):
+    """Return the system key ('chiller', 'boiler', 'ahu') for a unit ID or abnormality line, or None."""
+    for system in SYSTEMS:
+        if system["unit_prefix"] in component:
+            return system["key"]
+    return None
+
+
+class EquipmentSchema:
+    """Compiled topology for one building: a flat tuple of unit IDs per system."""
+
+    def __init__(self, building, units):
+        self.building = building
+        # system key -> tuple of unit IDs, in snapshot order
+        self.units = units
+
+    @classmethod
+    def from_raw(cls, raw_data):
+        equipment = raw_data.get("equipment", {}) if isinstance(raw_data, dict) else {}
+        units = {}
+        for system in SYSTEMS:
+            block = equipment.get(system["raw_key"])
+            if isinstance(block, dict):
+                units[system["key"]] = tuple(
+                    k for k, v in block.items() if k.startswith(system["unit_prefix"]) and isinstance(v, dict)
+                )
+        return cls(raw_data.get("building") if isinstance(raw_data, dict) else None, units)
+
+    def values(self, raw_data, system_key, point):
+        """Read one point across every unit of a system, in unit order."""
+        system = SYSTEMS_BY_KEY[system_key]
+        block = raw_data.get("equipment", {}).get(system["raw_key"], {})
+        default = POINT_DEFAULTS.get(point, 0)
+        return [block.get(unit, {}).get(point, default) for unit in self.units.get(system_key, ())]
+
+    def summarize(self, raw_data):
+        """Build the same summary dict shape the AI returns, from raw readings."""
+        equipment = raw_data.get("equipment", {})
+        summary = {}
+        if "chiller" in self.units:
+            status = self.values(raw_data, "chiller", "status")
+            summary["chillerSystem"] = {
+                "totalCompressorsRunning": sum(1 for s in status if s == "Running"),
+                "chilledWaterSupplyTemp": equipment["ChillerSystem"].get("chilledWaterSupplyTemp", "N/A"),
+            }
+        if "boiler" in self.units:
+            burners = self.values(raw_data, "boiler", "burnerStatus")
+            summary["boilerSystem"] = {
+                "boilersOn": sum(1 for b in burners if b == "On"),
+                "hotWaterSupplyTemp": equipment["BoilerSystem"].get("hotWaterSupplyTemp", "N/A"),
+            }
+        if "ahu" in self.units:
+            readings = self.values(raw_data, "ahu", "supplyAirTemp")
+            supply_temps = [t for t in readings if isinstance(t, (int, float))]
+            summary["airHandlers"] = {
+                "totalAHUs": len(readings),
+                "averageSupplyAirTemp": round(sum(supply_temps) / len(supply_temps), 1) if supply_temps else "N/A",
+            }
+        return summary
+
+    def check(self, raw_data):
+        """Run every rule over its point columns; return abnormalities as AI-style dicts."""
+        result = []
+        for system in SYSTEMS:
+            unit_ids = self.units.get(system["key"])
+            if not unit_ids:
+                continue
+            for rule in system["rules"]:
+                columns = [self.values(raw_data, system["key"], p) for p in rule["points"]]
+                for unit, row in zip(unit_ids, zip(*columns)):
+                    try:
+                        hit = rule["test"](*row)
+                    except TypeError:
+                        continue
+                    if hit:
+                        ab = {"component": unit, "issue": rule["issue"], "value": rule["value"].format(*row)}
+                        if "normalRange" in rule:
+                            ab["normalRange"] = rule["normalRange"]
+                        result.append(ab)
+        return result
+
+    def total_units(self):
+        return sum(len(u) for u in self.units.values())
+
+    def key_points(self, raw_data):
+        """Numeric headline readings keyed by point ID, e.g. 'ChillerSystem.chilledWaterSupplyTemp'."""
+        equipment = raw_data.get("equipment", {})
+        points = {}
+        for system in SYSTEMS:
+            block = equipment.get(system["raw_key"])
+            if not isinstance(block, dict):
+                continue
+            for point in system["key_points"]:
+                value = block.get(point)
+                if isinstance(value, (int, float)):
+                    points[f"{system['raw_key']}.{point}"] = value
+            for point in system["unit_key_points"]:
+                values = [v for v in self.values(raw_data, system["key"], point) if isinstance(v, (int, float))]
+                if values:
+                    points[f"{system['raw_key']}.avg.{point}"] = round(sum(values) / len(values), 1)
+        return points
+
+    def chart(self, raw_data, system_key="chiller"):
+        """Labels and values for the per-unit chart of one system."""
+        system = SYSTEMS_BY_KEY[system_key]
+        return {
+            "label": system["chart_label"],
+            "labels": list(self.units.get(system_key, ())),
+            "values": [v or 0 for v in self.values(raw_data, system_key, system["chart_point"])],
+        }
+
+
+def schema_for(raw_data):
+    """Compile the schema for one snapshot; a single pass over each system block's keys."""
+    return EquipmentSchema.from_raw(raw_data)
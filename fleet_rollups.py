@@ -0,0 +1,120 @@
+# fleet_rollups.py
+# Materialized cross-building aggregates. Each ingested entry updates its own
+# building's health score, open abnormality counts and 1m/15m/1h buckets in
+# O(points) and re-serializes only that building's JSON fragment; serving the
+# portfolio never touches history.
+#
+# The aggregates live in the memory of the process that runs ingestion (the
+# worker thread in web_dashboard). With several gunicorn workers each process
+# ingests its own stream, so /portfolio reflects that process only; run a
+# single ingesting worker for a consistent fleet view.
+import calendar, json, threading, time
+from equipment_schema import SYSTEMS, schema_for
+
+WINDOWS = {"1m": 60, "15m": 900, "1h": 3600}
+
+_lock = threading.Lock()
+_buildings = {}
+_fragments = {}
+_health_total = 0
+_open_total = 0
+_portfolio_json = None
+
+
+def _epoch(timestamp):
+    try:
+        return calendar.timegm(time.strptime(timestamp, "%Y-%m-%dT%H:%M:%SZ"))
+    except (TypeError, ValueError):
+        return int(time.time())
+
+
+def _roll(windows, value, ts):
+    for name, seconds in WINDOWS.items():
+        start = ts - ts % seconds
+        bucket = windows.get(name)
+        if bucket is None or start > bucket["start"]:
+            windows[name] = {
+                "start": start,
+                "count": 1,
+                "sum": value,
+                "min": value,
+                "max": value,
+                "mean": value,
+                "previous": bucket and {k: bucket[k] for k in ("start", "count", "min", "max", "mean")},
+            }
+        else:
+            # ingest() never passes a sample older than the last one, so this is the open bucket
+            bucket["count"] += 1
+            bucket["sum"] += value
+            bucket["min"] = min(bucket["min"], value)
+            bucket["max"] = max(bucket["max"], value)
+            bucket["mean"] = round(bucket["sum"] / bucket["count"], 2)
+
+
+def _public(state):
+    # Serialized view of a building's state, without the running sums and epoch used for bookkeeping
+    view = {k: v for k, v in state.items() if k not in ("epoch", "rollups")}
+    view["rollups"] = {
+        point: {name: {k: v for k, v in bucket.items() if k != "sum"} for name, bucket in windows.items()}
+        for point, windows in state["rollups"].items()
+    }
+    return view
+
+
+def ingest(raw_data, abnormalities, timestamp=None):
+    """Fold one snapshot and its formatted abnormality lines into the fleet aggregates."""
+    global _health_total, _open_total, _portfolio_json
+    if not isinstance(raw_data, dict) or not raw_data.get("building"):
+        return
+    building = raw_data["building"]
+    schema = schema_for(raw_data)
+    ts = _epoch(timestamp or raw_data.get("timestamp"))
+
+    # Only lines naming one of the building's units count, for both health and open counts
+    unit_systems = {unit: key for key, units in schema.units.items() for unit in units}
+    open_by_system = {s["key"]: 0 for s in SYSTEMS}
+    affected = set()
+    for line in abnormalities:
+        unit = line.split(":", 1)[0].strip()
+        if unit in unit_systems:
+            open_by_system[unit_systems[unit]] += 1
+            affected.add(unit)
+    open_count = sum(open_by_system.values())
+    total = schema.total_units()
+    health = round(100 * (total - min(len(affected), total)) / total) if total else 100
+
+    with _lock:
+        state = _buildings.get(building)
+        if state is None:
+            state = _buildings[building] = {"health": 0, "openAbnormalities": {}, "rollups": {}, "epoch": ts}
+        elif ts < state["epoch"]:
+            # Out-of-order samples are dropped entirely, for status and every window alike
+            return
+        _health_total += health - state["health"]
+        _open_total += open_count - sum(state["openAbnormalities"].values())
+        state.update({
+            "health": health,
+            "units": total,
+            "openAbnormalities": open_by_system,
+            "timestamp": timestamp or raw_data.get("timestamp"),
+            "epoch": ts,
+        })
+        for point, value in schema.key_points(raw_data).items():
+            _roll(state["rollups"].setdefault(point, {}), value, ts)
+        _fragments[building] = json.dumps(building) + ": " + json.dumps(_public(state))
+        _portfolio_json = None
+
+
+def portfolio_json():
+    """Serialized portfolio view; built from cached per-building fragments once per change."""
+    global _portfolio_json
+    with _lock:
+        if _portfolio_json is None:
+            count = len(_buildings)
+            fleet = json.dumps({
+                "buildings": count,
+                "averageHealth": round(_health_total / count, 1) if count else None,
+                "openAbnormalities": _open_total,
+            })
+            _portfolio_json = '{"buildings": {' + ", ".join(_fragments.values()) + '}, "fleet": ' + fleet + "}"
+        return _portfolio_json
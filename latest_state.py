@@ -0,0 +1,177 @@
+# latest_state.py
+# Shared "latest state" snapshot for gunicorn workers. The ingestion side
+# publishes each building's normalized latest entry (pre-serialized JSON) into
+# a fixed-layout memory-mapped file; web workers read it without parsing.
+#
+# Layout:
+#   header  MAGIC (8s) | version (Q) | slot count (I) | slot size (I)
+#   slot i  seq (Q) | payload length (I) | name length (H) | pad (H) | name | payload
+#
+# Each slot is a seqlock: writers bump `seq` to odd, write, then bump to even;
+# readers retry while `seq` is odd or changed under them. Writers in different
+# processes serialize on flock, readers never lock. The header version is
+# bumped by touch() whenever the history file is saved, so readers can skip
+# reloading it when nothing changed.
+#
+# Limits: LATEST_STATE_BUILDINGS slots of LATEST_STATE_SLOT_SIZE bytes each
+# (defaults 256 x 256 KiB, sparse on disk) and building names of at most
+# NAME_SIZE bytes. The payload is the full /latest response including
+# raw_data, roughly 80-150 bytes per unit depending on open abnormalities,
+# so the default slot covers about 2000 units. A payload or building name that does not fit is not published; /latest then falls back to the history file
+# for that building and a warning is printed on every rejected publish.
+import fcntl, mmap, os, struct
+
+STATE_FILE = os.getenv("LATEST_STATE_FILE", "/tmp/building_latest_state.bin")
+MAX_BUILDINGS = int(os.getenv("LATEST_STATE_BUILDINGS", 256))
+SLOT_SIZE = int(os.getenv("LATEST_STATE_SLOT_SIZE", 256 * 1024))
+
+MAGIC = b"BASLATE1"
+HEADER = struct.Struct("<8sQII")
+SLOT_HEADER = struct.Struct("<QIHH")
+NAME_SIZE = 112
+PAYLOAD_OFFSET = SLOT_HEADER.size + NAME_SIZE
+MAX_PAYLOAD = SLOT_SIZE - PAYLOAD_OFFSET
+READ_RETRIES = 100
+
+_fd = None
+_mm = None
+_slots = {}
+_cache = {}
+
+
+def _open():
+    global _fd, _mm
+    if _mm is not None:
+        return _mm
+    size = HEADER.size + MAX_BUILDINGS * SLOT_SIZE
+    fd = os.open(STATE_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+        header = os.pread(fd, HEADER.size, 0)
+        fresh = len(header) < HEADER.size
+        if not fresh:
+            magic, _, count, slot_size = HEADER.unpack(header)
+            fresh = magic != MAGIC or count != MAX_BUILDINGS or slot_size != SLOT_SIZE
+        if fresh:
+            # Zero the file by truncation so it stays sparse, then write only the header
+            os.ftruncate(fd, 0)
+            os.ftruncate(fd, size)
+            os.pwrite(fd, HEADER.pack(MAGIC, 0, MAX_BUILDINGS, SLOT_SIZE), 0)
+        mm = mmap.mmap(fd, size)
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    _fd, _mm = fd, mm
+    return mm
+
+
+def _slot_offset(index):
+    return HEADER.size + index * SLOT_SIZE
+
+
+def _find_slot(mm, name):
+    """Index of the slot holding `name`, or of the first free slot (negated, minus one), cached per process."""
+    if name in _slots:
+        return _slots[name]
+    free = None
+    for i in range(MAX_BUILDINGS):
+        offset = _slot_offset(i)
+        _, _, name_len, _ = SLOT_HEADER.unpack_from(mm, offset)
+        if name_len == 0:
+            if free is None:
+                free = i
+            continue
+        start = offset + SLOT_HEADER.size
+        if mm[start:start + name_len] == name:
+            _slots[name] = i
+            return i
+    return -1 - free if free is not None else None
+
+
+def version():
+    """Global publish counter; 0 if the state file cannot be opened."""
+    try:
+        return HEADER.unpack_from(_open(), 0)[1]
+    except OSError as e:
+        print(f"⚠️ Error opening latest state: {e}")
+        return 0
+
+
+def _bump(mm):
+    magic, current, count, slot_size = HEADER.unpack_from(mm, 0)
+    HEADER.pack_into(mm, 0, magic, current + 1, count, slot_size)
+
+
+def touch():
+    """Bump the global version; called after every history save, whether or not a slot was published."""
+    try:
+        mm = _open()
+        fcntl.flock(_fd, fcntl.LOCK_EX)
+    except OSError as e:
+        print(f"❌ Error updating latest state: {e}")
+        return
+    try:
+        _bump(mm)
+    finally:
+        fcntl.flock(_fd, fcntl.LOCK_UN)
+
+
+def publish(building, payload):
+    """Publish pre-serialized JSON bytes as the latest state for `building`. Returns False if it does not fit."""
+    name = building.encode("utf-8")
+    if len(name) > NAME_SIZE:
+        print(f"⚠️ Building name {building!r} longer than {NAME_SIZE} bytes, latest state not published")
+        return False
+    if len(payload) > MAX_PAYLOAD:
+        print(f"⚠️ Latest state for {building} too large ({len(payload)} bytes, limit {MAX_PAYLOAD}), not published; raise LATEST_STATE_SLOT_SIZE")
+        return False
+    try:
+        mm = _open()
+        fcntl.flock(_fd, fcntl.LOCK_EX)
+    except OSError as e:
+        print(f"❌ Error publishing latest state: {e}")
+        return False
+    try:
+        index = _find_slot(mm, name)
+        if index is None:
+            print(f"⚠️ No free latest-state slot for {building}; raise LATEST_STATE_BUILDINGS")
+            return False
+        claim = index < 0
+        if claim:
+            index = -1 - index
+        offset = _slot_offset(index)
+        seq = SLOT_HEADER.unpack_from(mm, offset)[0]
+        SLOT_HEADER.pack_into(mm, offset, seq + 1, 0, len(name), 0)
+        mm[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + len(name)] = name
+        mm[offset + PAYLOAD_OFFSET:offset + PAYLOAD_OFFSET + len(payload)] = payload
+        SLOT_HEADER.pack_into(mm, offset, seq + 2, len(payload), len(name), 0)
+        if claim:
+            _slots[name] = index
+        return True
+    finally:
+        fcntl.flock(_fd, fcntl.LOCK_UN)
+
+
+def read(building):
+    """Latest published JSON bytes for `building`, or None. Unchanged slots return the cached bytes."""
+    name = building.encode("utf-8")
+    try:
+        mm = _open()
+    except OSError as e:
+        print(f"⚠️ Error opening latest state: {e}")
+        return None
+    index = _find_slot(mm, name)
+    if index is None or index < 0:
+        return None
+    offset = _slot_offset(index)
+    cached = _cache.get(name)
+    for _ in range(READ_RETRIES):
+        seq, length, _, _ = SLOT_HEADER.unpack_from(mm, offset)
+        if seq & 1:
+            continue
+        if cached and cached[0] == seq:
+            return cached[1]
+        payload = mm[offset + PAYLOAD_OFFSET:offset + PAYLOAD_OFFSET + length]
+        if SLOT_HEADER.unpack_from(mm, offset)[0] == seq:
+            _cache[name] = (seq, payload)
+            return payload
+    return cached[1] if cached else None
@@ -1,7 +1,10 @@
 from flask import Flask, render_template_string, request, redirect, url_for
 import threading, time, json, os
 from data_simulator import simulate
-from ai_diagnosis import analyze
+from ai_diagnosis import DIAGNOSIS_BACKEND, analyze, compare, fit_backends
+from equipment_schema import SYSTEMS, schema_for, system_for_component
+import fleet_rollups
+import latest_state
 
 app = Flask(__name__, static_folder="static")
 
@@ -9,6 +12,10 @@ app = Flask(__name__, static_folder="static")
 DATA_FILE = "/tmp/building_data_history.json"
 CLIENTS_FILE = "clients.json"
 MAX_HISTORY = 20
+# Admin code for the cross-building /portfolio view; the route is disabled when unset
+PORTFOLIO_CODE = os.getenv("PORTFOLIO_CODE")
+# Admin code for /debug/compare, which may call the paid gpt-4o backend; disabled when unset
+COMPARE_CODE = os.getenv("COMPARE_CODE")
 
 def load_data_store():
     try:
@@ -38,6 +45,7 @@ def load_clients():
 
 data_store = load_data_store()
 clients = load_clients()
+fit_backends(data_store)
 
 def safe_json_dump(obj, indent=None, max_length=500):
     try:
@@ -69,6 +77,13 @@ def worker():
             }
             data_store.insert(0, entry)
             save_data_store(data_store)
+            try:
+                normalized = normalize_entry(entry)
+                update_rollups(normalized)
+                publish_latest(normalized)
+            except Exception as e:
+                print(f"⚠️ Error updating rollups/latest state: {e}")
+            latest_state.touch()
         except Exception as e:
             print("❌ Error in worker:", str(e))
             entry = {
@@ -79,13 +94,10 @@ def worker():
             }
             data_store.insert(0, entry)
             save_data_store(data_store)
+            latest_state.touch()
         time.sleep(60)
 
-print("Starting worker thread...")
-thread = threading.Thread(target=worker, daemon=True)
-thread.start()
-
-def format_summary(summary_data, raw_data=None):
+def format_summary(summary_data, raw_data=None, schema=None):
     try:
         lines = []
         if isinstance(summary_data, dict):
@@ -108,32 +120,16 @@ def format_summary(summary_data, raw_data=None):
                 return " ".join(lines)
         
         if raw_data and isinstance(raw_data, dict) and "equipment" in raw_data:
-            equipment = raw_data["equipment"]
-            if "ChillerSystem" in equipment:
-                chiller = equipment["ChillerSystem"]
-                comps = sum(1 for k in chiller if k.startswith("Compressor") and chiller[k].get("status") == "Running")
-                chilled = chiller.get("chilledWaterSupplyTemp", "N/A")
-                lines.append(f"Chiller: {comps} compressors running, chilled water at {chilled}°F.")
-            if "BoilerSystem" in equipment:
-                boiler = equipment["BoilerSystem"]
-                boilers = sum(1 for k in boiler if k.startswith("Boiler") and boiler[k].get("burnerStatus") == "On")
-                hot = boiler.get("hotWaterSupplyTemp", "N/A")
-                lines.append(f"Boiler: {boilers} boiler(s) on, hot water at {hot}°F.")
-            if "AirHandlers" in equipment:
-                ahu = equipment["AirHandlers"]
-                ahus = len([k for k in ahu if k.startswith("AHU")])
-                supply_temps = [ahu[k].get("supplyAirTemp", 0) for k in ahu if k.startswith("AHU")]
-                supply = round(sum(supply_temps) / len(supply_temps), 1) if supply_temps else "N/A"
-                lines.append(f"Air Handlers: {ahus} AHUs, average supply air at {supply}°F.")
-            if lines:
-                return " ".join(lines)
+            summary = (schema or schema_for(raw_data)).summarize(raw_data)
+            if summary:
+                return format_summary(summary)
         
         return "No system data available."
     except Exception as e:
         print(f"⚠️ Error formatting summary: {e}")
         return f"Error formatting summary: {str(e)}"
 
-def format_abnormalities(abnormalities, raw_data=None):
+def format_abnormalities(abnormalities, raw_data=None, schema=None):
     try:
         result = []
         if isinstance(abnormalities, list):
@@ -143,25 +139,7 @@ def format_abnormalities(abnormalities, raw_data=None):
                     result.append(f"{ab['component']}: {ab['issue']}{value}")
         
         if not result and raw_data and isinstance(raw_data, dict) and "equipment" in raw_data:
-            equipment = raw_data["equipment"]
-            if "ChillerSystem" in equipment:
-                chiller = equipment["ChillerSystem"]
-                for i in range(1, 4):
-                    comp = chiller.get(f"Compressor0{i}")
-                    if comp and comp.get("dischargePressure", 0) > 350:
-                        result.append(f"Compressor0{i}: High discharge pressure ({comp['dischargePressure']} psig, normal range: 300-350)")
-            if "BoilerSystem" in equipment:
-                boiler = equipment["BoilerSystem"]
-                for i in range(1, 3):
-                    b = boiler.get(f"Boiler0{i}")
-                    if b and b.get("burnerStatus") == "Off" and b.get("supplyTemp", 0) > 150:
-                        result.append(f"Boiler0{i}: Burner off but high supply temp ({b['supplyTemp']}°F)")
-            if "AirHandlers" in equipment:
-                ahu = equipment["AirHandlers"]
-                for i in range(1, 4):
-                    unit = ahu.get(f"AHU0{i}")
-                    if unit and unit.get("supplyAirTemp", 0) < 58:
-                        result.append(f"AHU0{i}: Low supply air temperature ({unit['supplyAirTemp']}°F, normal range: 58-62)")
+            return format_abnormalities((schema or schema_for(raw_data)).check(raw_data))
         
         return result
     except Exception as e:
@@ -179,21 +157,110 @@ def format_recommendations(recommendations, abnormalities):
         
         if abnormalities and not result:
             result = []
-            if any("Compressor" in ab for ab in abnormalities):
-                result.extend([
-                    "Check chiller condenser for fouling or scaling (Priority: High)",
-                    "Inspect cooling tower fan operation (Priority: Medium)"
-                ])
-            if any("Boiler" in ab for ab in abnormalities):
-                result.append("Investigate boiler sensor or control issues (Priority: Medium)")
-            if any("AHU" in ab for ab in abnormalities):
-                result.append("Check AHU cooling coils and temperature sensors (Priority: Medium)")
+            flagged = {system_for_component(ab) for ab in abnormalities}
+            for system in SYSTEMS:
+                if system["key"] in flagged:
+                    result.extend(f"{rec['action']} (Priority: {rec['priority']})" for rec in system["recommendations"])
         
         return result
     except Exception as e:
         print(f"⚠️ Error formatting recommendations: {e}")
         return []
 
+def format_chart(raw_data, schema=None):
+    try:
+        if raw_data and isinstance(raw_data, dict) and "equipment" in raw_data:
+            return (schema or schema_for(raw_data)).chart(raw_data)
+    except Exception as e:
+        print(f"⚠️ Error formatting chart: {e}")
+    return {"label": "Discharge Pressure (psig)", "labels": [], "values": []}
+
+def normalize_entry(entry, raw_data=None):
+    try:
+        status = json.loads(entry["status"]) if entry["status"] else {}
+        if raw_data is None:
+            raw_data = json.loads(entry.get("raw_data", "{}"))
+        summary = status.get("summary", "No summary available")
+        abnormalities = status.get("abnormalities", [])
+        recommendations = status.get("recommendations", [])
+        
+        if isinstance(summary, str) and summary.startswith("```json\n") and summary.endswith("\n```"):
+            try:
+                nested_data = json.loads(summary[8:-4])
+                if isinstance(nested_data, dict):
+                    summary = nested_data.get("summary", summary)
+                    abnormalities = nested_data.get("abnormalities", abnormalities)
+                    recommendations = nested_data.get("recommendations", recommendations)
+            except (json.JSONDecodeError, ValueError) as e:
+                print(f"⚠️ Error parsing JSON code block: {e}")
+        
+        # Compile the snapshot's schema once and share it across the formatters
+        schema = schema_for(raw_data)
+        if isinstance(summary, dict):
+            summary = format_summary(summary, raw_data, schema)
+        elif not summary.strip() or summary == "No summary available":
+            summary = format_summary({}, raw_data, schema)
+        
+        abnormalities = format_abnormalities(abnormalities, raw_data, schema)
+        recommendations = format_recommendations(recommendations, abnormalities)
+        
+        status = {
+            "summary": str(summary),
+            "abnormalities": abnormalities,
+            "recommendations": recommendations
+        }
+        return {
+            "status": status,
+            "timestamp": entry["timestamp"],
+            "error": entry.get("error"),
+            "raw_data": raw_data,
+            "chart": format_chart(raw_data, schema)
+        }
+    except (json.JSONDecodeError, ValueError, TypeError, AttributeError) as e:
+        print(f"⚠️ Error parsing status for timestamp {entry.get('timestamp')}: {e}")
+        return {
+            "status": {"summary": "Error parsing data", "abnormalities": [], "recommendations": []},
+            "timestamp": entry.get("timestamp"),
+            "error": f"Parsing error: {str(e)}",
+            "raw_data": {},
+            "chart": format_chart({})
+        }
+
+def update_rollups(normalized):
+    fleet_rollups.ingest(normalized["raw_data"], normalized["status"]["abnormalities"], normalized["timestamp"])
+
+def publish_latest(normalized):
+    building = normalized["raw_data"].get("building")
+    if building:
+        latest_state.publish(building, json.dumps(normalized).encode("utf-8"))
+
+data_store_version = latest_state.version()
+# building -> (data_store_version, processed entries) for /dashboard
+processed_cache = {}
+
+def refresh_data_store():
+    # Re-read the history file only when the ingestion side has published since our last load
+    global data_store, data_store_version
+    current = latest_state.version()
+    if current != data_store_version or not current:
+        data_store = load_data_store()
+        data_store_version = current
+
+# Seed the fleet rollups from stored history (oldest first) and publish each building's newest entry
+normalized_history = [normalize_entry(stored_entry) for stored_entry in data_store]
+for normalized in reversed(normalized_history):
+    update_rollups(normalized)
+published = set()
+for normalized in normalized_history:
+    building = normalized["raw_data"].get("building")
+    if building and building not in published:
+        publish_latest(normalized)
+        published.add(building)
+
+print("Starting worker thread...")
+thread = threading.Thread(target=worker, daemon=True)
+thread.start()
+
 # Homepage template
 HOME_TEMPLATE = """
 <!DOCTYPE html>
@@ -364,19 +431,15 @@ DASHBOARD_TEMPLATE = """
         // Render charts
         {% for entry in data_store %}
         try {
-            const rawData = {{ entry.raw_data | safe }};
+            const chart = {{ entry.chart | tojson }};
             const ctx = document.getElementById('pressureChart-{{ loop.index }}').getContext('2d');
             new Chart(ctx, {
                 type: 'line',
                 data: {
-                    labels: ['Compressor01', 'Compressor02', 'Compressor03'],
+                    labels: chart.labels,
                     datasets: [{
-                        label: 'Discharge Pressure (psig)',
-                        data: [
-                            rawData.equipment?.ChillerSystem?.Compressor01?.dischargePressure || 0,
-                            rawData.equipment?.ChillerSystem?.Compressor02?.dischargePressure || 0,
-                            rawData.equipment?.ChillerSystem?.Compressor03?.dischargePressure || 0
-                        ],
+                        label: chart.label,
+                        data: chart.values,
                         borderColor: '#3b82f6',
                         fill: false
                     }]
@@ -475,14 +538,10 @@ DASHBOARD_TEMPLATE = """
                         new Chart(ctx, {
                             type: 'line',
                             data: {
-                                labels: ['Compressor01', 'Compressor02', 'Compressor03'],
+                                labels: newEntry.chart?.labels || [],
                                 datasets: [{
-                                    label: 'Discharge Pressure (psig)',
-                                    data: [
-                                        newEntry.raw_data?.equipment?.ChillerSystem?.Compressor01?.dischargePressure || 0,
-                                        newEntry.raw_data?.equipment?.ChillerSystem?.Compressor02?.dischargePressure || 0,
-                                        newEntry.raw_data?.equipment?.ChillerSystem?.Compressor03?.dischargePressure || 0
-                                    ],
+                                    label: newEntry.chart?.label || 'Discharge Pressure (psig)',
+                                    data: newEntry.chart?.values || [],
                                     borderColor: '#3b82f6',
                                     fill: false
                                 }]
@@ -523,73 +582,43 @@ def index():
 @app.route("/dashboard/<client_code>")
 def dashboard(client_code):
     global data_store, clients
-    data_store = load_data_store()
+    refresh_data_store()
     client = next((c for c in clients if c["code"] == client_code), None)
     if not client:
         return redirect(url_for("index"))
     
     building = client["building"]
-    filtered_data = [entry for entry in data_store if json.loads(entry.get("raw_data", "{}")).get("building") == building]
-    print(f"📥 Dashboard hit for {building} — latest:", safe_json_dump(filtered_data[:2], indent=2))
-    
-    processed_data = []
-    for entry in filtered_data:
-        try:
-            status = json.loads(entry["status"]) if entry["status"] else {}
-            raw_data = json.loads(entry.get("raw_data", "{}"))
-            summary = status.get("summary", "No summary available")
-            abnormalities = status.get("abnormalities", [])
-            recommendations = status.get("recommendations", [])
-            
-            if isinstance(summary, str) and summary.startswith("```json\n") and summary.endswith("\n```"):
-                try:
-                    nested_data = json.loads(summary[8:-4])
-                    if isinstance(nested_data, dict):
-                        summary = nested_data.get("summary", summary)
-                        abnormalities = nested_data.get("abnormalities", abnormalities)
-                        recommendations = nested_data.get("recommendations", recommendations)
-                except (json.JSONDecodeError, ValueError) as e:
-                    print(f"⚠️ Error parsing JSON code block: {e}")
-            
-            if isinstance(summary, dict):
-                summary = format_summary(summary, raw_data)
-            elif not summary.strip() or summary == "No summary available":
-                summary = format_summary({}, raw_data)
-            
-            abnormalities = format_abnormalities(abnormalities, raw_data)
-            recommendations = format_recommendations(recommendations, abnormalities)
-            
-            status = {
-                "summary": str(summary),
-                "abnormalities": abnormalities,
-                "recommendations": recommendations
-            }
-            processed_data.append({
-                "status": status,
-                "timestamp": entry["timestamp"],
-                "error": entry.get("error"),
-                "raw_data": raw_data
-            })
-        except (json.JSONDecodeError, ValueError, TypeError) as e:
-            print(f"⚠️ Error parsing status for timestamp {entry['timestamp']}: {e}")
-            processed_data.append({
-                "status": {"summary": "Error parsing data", "abnormalities": [], "recommendations": []},
-                "timestamp": entry["timestamp"],
-                "error": f"Parsing error: {str(e)}",
-                "raw_data": {}
-            })
+    cached = processed_cache.get(building)
+    if data_store_version and cached and cached[0] == data_store_version:
+        processed_data = cached[1]
+    else:
+        processed_data = []
+        for entry in data_store:
+            try:
+                raw_data = json.loads(entry.get("raw_data", "{}"))
+            except (json.JSONDecodeError, ValueError, TypeError) as e:
+                print(f"⚠️ Skipping malformed entry at {entry.get('timestamp')}: {e}")
+                continue
+            if isinstance(raw_data, dict) and raw_data.get("building") == building:
+                processed_data.append(normalize_entry(entry, raw_data))
+        processed_cache[building] = (data_store_version, processed_data)
+    print(f"📥 Dashboard hit for {building} — latest:", safe_json_dump(processed_data[:2], indent=2))
     
     return render_template_string(DASHBOARD_TEMPLATE, data_store=processed_data, building=building, client_code=client_code, MAX_HISTORY=MAX_HISTORY)
 
 @app.route("/latest/<client_code>")
 def latest(client_code):
     global data_store, clients
-    data_store = load_data_store()
     client = next((c for c in clients if c["code"] == client_code), None)
     if not client:
         return json.dumps({"error": "Invalid client code"}), 403
     
     building = client["building"]
+    payload = latest_state.read(building)
+    if payload is not None:
+        return app.response_class(payload, mimetype="application/json")
+    
+    refresh_data_store()
     filtered_data = [entry for entry in data_store if json.loads(entry.get("raw_data", "{}")).get("building") == building]
     if not filtered_data:
         return json.dumps({
@@ -599,48 +628,13 @@ def latest(client_code):
             "raw_data": {}
         })
     
-    entry = filtered_data[0]
-    try:
-        status = json.loads(entry["status"]) if entry["status"] else {}
-        raw_data = json.loads(entry.get("raw_data", "{}"))
-        summary = status.get("summary", "No summary available")
-        abnormalities = status.get("abnormalities", [])
-        recommendations = status.get("recommendations", [])
-        
-        if isinstance(summary, str) and summary.startswith("```json\n") and summary.endswith("\n```"):
-            try:
-                nested_data = json.loads(summary[8:-4])
-                if isinstance(nested_data, dict):
-                    summary = nested_data.get("summary", summary)
-                    abnormalities = nested_data.get("abnormalities", abnormalities)
-                    recommendations = nested_data.get("recommendations", recommendations)
-            except (json.JSONDecodeError, ValueError) as e:
-                print(f"⚠️ Error parsing JSON code block: {e}")
-        
-        if isinstance(summary, dict):
-            summary = format_summary(summary, raw_data)
-        elif not summary.strip() or summary == "No summary available":
-            summary = format_summary({}, raw_data)
-        
-        abnormalities = format_abnormalities(abnormalities, raw_data)
-        recommendations = format_recommendations(recommendations, abnormalities)
-        
-        status = {
-            "summary": str(summary),
-            "abnormalities": abnormalities,
-            "recommendations": recommendations
-        }
-    except (json.JSONDecodeError, ValueError, TypeError) as e:
-        print(f"⚠️ Error parsing latest status: {e}")
-        status = {"summary": "Error parsing data", "abnormalities": [], "recommendations": []}
-        entry["error"] = f"Parsing error: {str(e)}"
-    
-    return json.dumps({
-        "status": status,
-        "timestamp": entry["timestamp"],
-        "error": entry.get("error"),
-        "raw_data": raw_data
-    })
+    return json.dumps(normalize_entry(filtered_data[0]))
+
+@app.route("/portfolio/<admin_code>")
+def portfolio(admin_code):
+    if not PORTFOLIO_CODE or admin_code != PORTFOLIO_CODE:
+        return json.dumps({"error": "Invalid admin code"}), 403
+    return app.response_class(fleet_rollups.portfolio_json(), mimetype="application/json")
 
 @app.route("/debug")
 def debug():
@@ -650,6 +644,24 @@ def debug():
     except Exception as e:
         return f"Error reading data_store: {str(e)}"
 
+@app.route("/debug/compare/<admin_code>")
+def debug_compare(admin_code):
+    # Run the newest stored snapshot through the configured backend and the local one:
+    # latency and abnormality agreement. Gated because the openai backend is a paid call.
+    if not COMPARE_CODE or admin_code != COMPARE_CODE:
+        return json.dumps({"error": "Invalid admin code"}), 403
+    refresh_data_store()
+    for entry in data_store:
+        try:
+            raw_data = json.loads(entry.get("raw_data", "{}"))
+        except (json.JSONDecodeError, ValueError, TypeError) as e:
+            print(f"⚠️ Skipping malformed entry for comparison: {e}")
+            continue
+        if isinstance(raw_data, dict) and "equipment" in raw_data:
+            backends = tuple(dict.fromkeys((DIAGNOSIS_BACKEND, "local")))
+            return f"<pre>{safe_json_dump(compare(raw_data, backends), indent=2, max_length=100000)}</pre>"
+    return "No snapshot available for comparison"
+
 if __name__ == "__main__":
     import os
     port = int(os.environ.get("PORT", 10000))